@@ -0,0 +1,151 @@
+# fileserver/analytics.py
+import atexit
+import threading
+import time
+import datetime as dt
+
+from sqlalchemy import func
+
+from .models import db, DownloadStat, File, ApiToken
+from .utils import PerProcessThread
+
+# Reihenfolge der Zähler in den In-Memory-Einträgen
+COUNTERS = ("requests", "bytes_sent", "range_requests", "full_requests", "not_modified")
+# Obergrenze für ungeschriebene Einträge, falls die DB länger nicht erreichbar ist
+MAX_PENDING_KEYS = 50_000
+
+class DownloadStats:
+    """
+    Zählt Downloads pro Worker im Speicher und schreibt die Deltas
+    periodisch in einer Transaktion nach download_stats (Write-Behind).
+    So entsteht pro Request kein eigener Commit.
+    """
+
+    def __init__(self, app=None):
+        self._app = None
+        self.bucket_seconds = 3600
+        self.flush_seconds = 30
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._flusher = PerProcessThread("download-stats-flush", self.flush, self.flush_seconds, self._reset)
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self._app = app
+        self.bucket_seconds = app.config.get("ANALYTICS_BUCKET_SECONDS", 3600)
+        self.flush_seconds = app.config.get("ANALYTICS_FLUSH_SECONDS", 30)
+        self._flusher.interval = self.flush_seconds
+        app.extensions["download_stats"] = self
+        atexit.register(self.flush)
+
+    def record(self, file_id: str, token_id: int | None, status: int, nbytes: int):
+        self._flusher.ensure_started()
+        bucket = int(time.time()) // self.bucket_seconds * self.bucket_seconds
+        key = (bucket, file_id, token_id)
+        with self._lock:
+            c = self._pending.get(key)
+            if c is None:
+                c = self._pending[key] = [0] * len(COUNTERS)
+            c[0] += 1
+            c[1] += nbytes
+            if status == 206:
+                c[2] += 1
+            elif status == 200:
+                c[3] += 1
+            elif status == 304:
+                c[4] += 1
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending or self._app is None:
+            return
+        try:
+            with self._app.app_context():
+                with db.engine.begin() as conn:
+                    for (bucket, file_id, token_id), c in pending.items():
+                        _upsert(conn, dt.datetime.utcfromtimestamp(bucket), file_id, token_id, c)
+        except Exception:
+            self._app.logger.exception("Download-Statistik konnte nicht geschrieben werden.")
+            # Deltas nicht verlieren – beim nächsten Flush erneut versuchen
+            with self._lock:
+                for key, c in pending.items():
+                    cur = self._pending.setdefault(key, [0] * len(COUNTERS))
+                    for i, v in enumerate(c):
+                        cur[i] += v
+                dropped = self._trim_locked()
+            if dropped:
+                self._app.logger.warning(
+                    "Download-Statistik: %d ältere Einträge verworfen (Limit %d).", dropped, MAX_PENDING_KEYS
+                )
+
+    def _trim_locked(self) -> int:
+        # Älteste Buckets zuerst verwerfen; Aufrufer hält self._lock
+        overflow = len(self._pending) - MAX_PENDING_KEYS
+        if overflow <= 0:
+            return 0
+        for key in sorted(self._pending, key=lambda k: k[0])[:overflow]:
+            del self._pending[key]
+        return overflow
+
+    def _reset(self):
+        # Vom Master geerbte Zähler gehören nicht zu diesem Worker
+        self._lock = threading.Lock()
+        self._pending = {}
+
+def _upsert(conn, bucket_start, file_id, token_id, counters):
+    t = DownloadStat.__table__
+    where = (t.c.bucket_start == bucket_start) & (t.c.file_id == file_id) & (
+        t.c.token_id.is_(None) if token_id is None else t.c.token_id == token_id
+    )
+    values = {name: t.c[name] + counters[i] for i, name in enumerate(COUNTERS)}
+    res = conn.execute(t.update().where(where).values(**values))
+    if res.rowcount == 0:
+        conn.execute(t.insert().values(
+            bucket_start=bucket_start, file_id=file_id, token_id=token_id,
+            **{name: counters[i] for i, name in enumerate(COUNTERS)}
+        ))
+
+download_stats = DownloadStats()
+
+# ---------- Auswertungen ----------
+
+def _sums():
+    return [func.sum(getattr(DownloadStat, name)).label(name) for name in COUNTERS]
+
+def _row_dict(row, keys):
+    d = dict(zip(keys, row[:len(keys)]))
+    d.update({name: int(v or 0) for name, v in zip(COUNTERS, row[len(keys):])})
+    return d
+
+def top_files(since: dt.datetime, limit: int = 20):
+    rows = (
+        db.session.query(DownloadStat.file_id, File.title, *_sums())
+        .outerjoin(File, File.id == DownloadStat.file_id)
+        .filter(DownloadStat.bucket_start >= since)
+        .group_by(DownloadStat.file_id, File.title)
+        .order_by(func.sum(DownloadStat.requests).desc())
+        .limit(limit)
+        .all()
+    )
+    return [_row_dict(r, ("file_id", "title")) for r in rows]
+
+def top_tokens(since: dt.datetime, limit: int = 20):
+    rows = (
+        db.session.query(DownloadStat.token_id, ApiToken.name, *_sums())
+        .outerjoin(ApiToken, ApiToken.id == DownloadStat.token_id)
+        .filter(DownloadStat.bucket_start >= since)
+        .group_by(DownloadStat.token_id, ApiToken.name)
+        .order_by(func.sum(DownloadStat.requests).desc())
+        .limit(limit)
+        .all()
+    )
+    return [_row_dict(r, ("token_id", "name")) for r in rows]
+
+def time_series(since: dt.datetime, file_id: str | None = None):
+    q = db.session.query(DownloadStat.bucket_start, *_sums()).filter(DownloadStat.bucket_start >= since)
+    if file_id:
+        q = q.filter(DownloadStat.file_id == file_id)
+    rows = q.group_by(DownloadStat.bucket_start).order_by(DownloadStat.bucket_start.asc()).all()
+    return [_row_dict(r, ("bucket_start",)) for r in rows]
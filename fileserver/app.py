@@ -1,12 +1,20 @@
 import os
+import datetime as dt
 from flask import Flask
 from flask_cors import CORS
 from dotenv import load_dotenv, find_dotenv
 from werkzeug.middleware.proxy_fix import ProxyFix
 
+from sqlalchemy import inspect, text, select, literal, exists
+from sqlalchemy.exc import DBAPIError, IntegrityError
+
 from .config import Config, get_cors_resources
-from .models import db, AdminUser
+from .models import db, AdminUser, File, FileChange, FileSummary, SchemaMarker
 from .routes import admin_bp, api_bp
+from .analytics import download_stats
+from .profiling import request_profiler
+
+BACKFILL_MARKER = "file_changes_backfill"
 
 # .env laden – sucht im Projekt (robuster)
 load_dotenv(find_dotenv())
@@ -19,8 +27,13 @@ def create_app():
     app.wsgi_app = ProxyFix(app.wsgi_app, x_for=1, x_proto=1, x_host=1, x_port=1, x_prefix=1)
 
     db.init_app(app)
+    download_stats.init_app(app)
+    request_profiler.init_app(app)
     with app.app_context():
-        db.create_all()
+        _create_tables()
+        _ensure_schema()
+        _backfill_change_log()
+        FileSummary.get()  # legt die Kennzahlen beim ersten Start einmalig an
         _ensure_initial_admin(app)
 
     CORS(app, resources=get_cors_resources())
@@ -30,6 +43,71 @@ def create_app():
 
     return app
 
+def _create_tables():
+    # create_all prüft je Tabelle vorab – startet ein anderer Worker parallel,
+    # kann CREATE trotzdem scheitern; der zweite Durchlauf sieht dann alle Tabellen
+    try:
+        db.create_all()
+    except DBAPIError:
+        db.create_all()
+
+def _ensure_schema():
+    """
+    create_all() legt nur fehlende Tabellen an – neue Spalten bestehender
+    Tabellen werden hier nachgezogen (kein Migrations-Tool im PoC).
+    Robust gegen parallele Starts: scheitert das ALTER, weil ein anderer
+    Worker schneller war, wird erneut geprüft statt abzubrechen.
+    """
+    if not _has_column(File.__tablename__, "updated_at"):
+        col_type = File.__table__.c.updated_at.type.compile(dialect=db.engine.dialect)
+        try:
+            with db.engine.begin() as conn:
+                conn.execute(text(f"ALTER TABLE {File.__tablename__} ADD COLUMN updated_at {col_type}"))
+                conn.execute(text(f"UPDATE {File.__tablename__} SET updated_at = created_at"))
+        except DBAPIError:
+            if not _has_column(File.__tablename__, "updated_at"):
+                raise
+    # Neue Indizes (Sortierung/Filter im Dashboard) auch auf Bestandstabellen
+    existing = {i["name"] for i in inspect(db.engine).get_indexes(File.__tablename__)}
+    for index in File.__table__.indexes:
+        if index.name in existing:
+            continue
+        try:
+            index.create(db.engine)
+        except DBAPIError:
+            # paralleler Start: anderer Worker hat den Index bereits angelegt
+            if index.name not in {i["name"] for i in inspect(db.engine).get_indexes(File.__tablename__)}:
+                raise
+
+def _has_column(table: str, column: str) -> bool:
+    return column in {c["name"] for c in inspect(db.engine).get_columns(table)}
+
+def _backfill_change_log():
+    """
+    Bestandsdateien ohne Änderungsprotokoll bekommen je ein 'create'-Ereignis,
+    damit ein Client mit since=0 den vollständigen Katalog erhält.
+    Läuft genau einmal: Der Marker wird in derselben Transaktion zuerst eingefügt.
+    Ein parallel startender Worker wartet auf dessen Primärschlüssel und scheitert
+    nach dem Commit des ersten mit IntegrityError – sein Backfill wird verworfen.
+    """
+    if SchemaMarker.query.get(BACKFILL_MARKER) is not None:
+        return
+    missing = (
+        select(File.id, literal("create"), File.created_at)
+        .where(~exists().where(FileChange.file_id == File.id))
+        .order_by(File.created_at.asc())
+    )
+    try:
+        with db.engine.begin() as conn:
+            conn.execute(SchemaMarker.__table__.insert().values(
+                name=BACKFILL_MARKER, created_at=dt.datetime.utcnow()
+            ))
+            conn.execute(FileChange.__table__.insert().from_select(
+                ["file_id", "op", "created_at"], missing
+            ))
+    except IntegrityError:
+        pass  # anderer Worker hat den Backfill bereits ausgeführt
+
 def _ensure_initial_admin(app: Flask):
     """
     Legt einen Admin an, wenn ADMIN_USERNAME + ADMIN_PASSWORD gesetzt sind
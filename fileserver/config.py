@@ -21,6 +21,12 @@ class Config:
     DOWNLOAD_HMAC_SECRET = os.getenv("DOWNLOAD_HMAC_SECRET", "download-secret-change-me")
     CORS_ORIGINS = os.getenv("CORS_ORIGINS", "")
     ALLOWED_EXT = _parse_allowed_ext()
+    # Download-Statistik: Bucket-Größe und Flush-Intervall (Sekunden)
+    ANALYTICS_BUCKET_SECONDS = int(os.getenv("ANALYTICS_BUCKET_SECONDS", "3600"))
+    ANALYTICS_FLUSH_SECONDS = int(os.getenv("ANALYTICS_FLUSH_SECONDS", "30"))
+    # Profiling: Ablage der .prof-Dateien je Sitzung und Worker
+    PROFILE_DIR = Path(os.getenv("PROFILE_DIR", STORAGE_DIR.parent / "profiles"))
+    PROFILE_DIR.mkdir(parents=True, exist_ok=True)
 
 def get_cors_resources():
     if not Config.CORS_ORIGINS:
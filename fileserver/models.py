@@ -1,3 +1,4 @@
+import json
 import datetime as dt
 from flask_sqlalchemy import SQLAlchemy
 from werkzeug.security import generate_password_hash, check_password_hash
@@ -7,6 +8,13 @@ db = SQLAlchemy()
 
 class File(db.Model):
     __tablename__ = "files"
+    # Je Sortierschlüssel im Dashboard ein Index auf (Schlüssel, id) – passend zum Keyset-Paging
+    __table_args__ = (
+        db.Index("ix_files_created_at_id", "created_at", "id"),
+        db.Index("ix_files_title_id", "title", "id"),
+        db.Index("ix_files_year_id", "year", "id"),
+        db.Index("ix_files_mime_type_id", "mime_type", "id"),
+    )
     id = db.Column(db.String(36), primary_key=True)  # UUID str
     title = db.Column(db.String(255), nullable=False)
     year = db.Column(db.Integer, nullable=True)
@@ -16,6 +24,136 @@ class File(db.Model):
     storage_path = db.Column(db.String(1024), nullable=False)
     checksum_sha256 = db.Column(db.String(64), nullable=True)
     created_at = db.Column(db.DateTime, default=dt.datetime.utcnow, nullable=False)
+    updated_at = db.Column(db.DateTime, default=dt.datetime.utcnow, onupdate=dt.datetime.utcnow, nullable=False)
+
+class FileSummary(db.Model):
+    """
+    Vorberechnete Kennzahlen fürs Dashboard (genau eine Zeile, id=1).
+    Upload/Löschen passen sie inkrementell an – kein COUNT/SUM pro Seitenaufruf.
+    """
+    __tablename__ = "file_summary"
+    id = db.Column(db.Integer, primary_key=True)
+    file_count = db.Column(db.Integer, default=0, nullable=False)
+    total_bytes = db.Column(db.BigInteger, default=0, nullable=False)
+
+    @classmethod
+    def get(cls):
+        return cls.query.get(1) or cls.rebuild()
+
+    @classmethod
+    def apply(cls, count_delta: int, bytes_delta: int):
+        """
+        Atomares Delta-Update in der laufenden Session – committet wird
+        zusammen mit Upload/Löschen durch den Aufrufer.
+        """
+        cls.query.filter_by(id=1).update({
+            cls.file_count: cls.file_count + count_delta,
+            cls.total_bytes: cls.total_bytes + bytes_delta,
+        }, synchronize_session=False)
+
+    @classmethod
+    def rebuild(cls):
+        count, total = db.session.query(
+            db.func.count(File.id), db.func.coalesce(db.func.sum(File.size_bytes), 0)
+        ).one()
+        rec = cls.query.get(1) or cls(id=1)
+        rec.file_count = count
+        rec.total_bytes = total
+        db.session.add(rec)
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # anderer Worker hat die Zeile parallel angelegt
+            db.session.rollback()
+            rec = cls.query.get(1)
+        return rec
+
+class FileChange(db.Model):
+    """
+    Append-only Änderungsprotokoll für /api/changes.
+    Die fortlaufende ID dient als Cursor; 'delete'-Einträge sind die Tombstones gelöschter Dateien.
+    """
+    __tablename__ = "file_changes"
+    id = db.Column(db.Integer, primary_key=True)
+    file_id = db.Column(db.String(36), nullable=False, index=True)
+    op = db.Column(db.String(16), nullable=False)  # "create" | "update" | "delete"
+    created_at = db.Column(db.DateTime, default=dt.datetime.utcnow, nullable=False)
+
+    @classmethod
+    def record(cls, file_id: str, op: str):
+        """
+        Hängt ein Ereignis an die aktuelle Session an – committet wird
+        zusammen mit der eigentlichen Änderung durch den Aufrufer.
+        """
+        change = cls(file_id=file_id, op=op)
+        db.session.add(change)
+        return change
+
+class SchemaMarker(db.Model):
+    """
+    Einmalige Datenmigrationen beim Start (kein Migrations-Tool im PoC).
+    Der Primärschlüssel sorgt dafür, dass genau ein Worker eine Migration ausführt.
+    """
+    __tablename__ = "schema_markers"
+    name = db.Column(db.String(64), primary_key=True)
+    created_at = db.Column(db.DateTime, default=dt.datetime.utcnow, nullable=False)
+
+class DownloadStat(db.Model):
+    """
+    Aggregierte Download-Zähler je Zeit-Bucket, Datei und Token.
+    Wird nur gebündelt aus fileserver.analytics geschrieben; Auswertungen summieren
+    (seltene Doppelzeilen durch parallele Worker sind damit unschädlich).
+    """
+    __tablename__ = "download_stats"
+    __table_args__ = (
+        db.Index("ix_download_stats_bucket_file_token", "bucket_start", "file_id", "token_id"),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    bucket_start = db.Column(db.DateTime, nullable=False)
+    file_id = db.Column(db.String(36), nullable=False, index=True)
+    token_id = db.Column(db.Integer, nullable=True)  # None = ohne Token (z. B. alte signierte URLs)
+    requests = db.Column(db.Integer, default=0, nullable=False)
+    bytes_sent = db.Column(db.BigInteger, default=0, nullable=False)
+    range_requests = db.Column(db.Integer, default=0, nullable=False)
+    full_requests = db.Column(db.Integer, default=0, nullable=False)
+    not_modified = db.Column(db.Integer, default=0, nullable=False)
+
+class ProfilingSession(db.Model):
+    """
+    Zeitlich begrenzte Profiling-Sitzung aus dem Admin. Liegt in der DB,
+    damit alle Gunicorn-Worker denselben Zustand sehen.
+    """
+    __tablename__ = "profiling_sessions"
+    id = db.Column(db.Integer, primary_key=True)
+    started_by = db.Column(db.String(120), nullable=True)
+    sample_rate = db.Column(db.Float, nullable=False)  # Anteil der Requests mit cProfile
+    slow_ms = db.Column(db.Integer, nullable=False)    # Schwelle für Slow-Request-Einträge
+    until = db.Column(db.DateTime, nullable=False)
+    stopped = db.Column(db.Boolean, default=False, nullable=False)
+    created_at = db.Column(db.DateTime, default=dt.datetime.utcnow, nullable=False)
+
+    @property
+    def is_active(self) -> bool:
+        return not self.stopped and self.until > dt.datetime.utcnow()
+
+class SlowRequest(db.Model):
+    __tablename__ = "slow_requests"
+    id = db.Column(db.Integer, primary_key=True)
+    session_id = db.Column(db.Integer, nullable=False, index=True)
+    method = db.Column(db.String(10), nullable=False)
+    path = db.Column(db.String(1024), nullable=False)  # ohne Query-String (Tokens!)
+    endpoint = db.Column(db.String(120), nullable=True)
+    status = db.Column(db.Integer, nullable=True)
+    duration_ms = db.Column(db.Float, nullable=False)
+    sql_count = db.Column(db.Integer, default=0, nullable=False)
+    sql_ms = db.Column(db.Float, default=0, nullable=False)
+    sql_top = db.Column(db.Text, nullable=True)  # JSON: langsamste Statements
+    profiled = db.Column(db.Boolean, default=False, nullable=False)
+    created_at = db.Column(db.DateTime, default=dt.datetime.utcnow, nullable=False)
+
+    @property
+    def sql_top_list(self):
+        return json.loads(self.sql_top) if self.sql_top else []
 
 class ApiToken(db.Model):
     __tablename__ = "api_tokens"
@@ -0,0 +1,267 @@
+# fileserver/profiling.py
+import atexit
+import cProfile
+import io
+import json
+import marshal
+import os
+import pstats
+import random
+import shutil
+import threading
+import time
+import datetime as dt
+from pathlib import Path
+
+from flask import g, request, has_request_context
+from sqlalchemy import event
+
+from .models import db, ProfilingSession, SlowRequest
+from .utils import PerProcessThread
+
+PROFILED_BLUEPRINTS = {"api", "admin"}
+STATE_TTL = 5      # Sekunden, wie lange ein Worker den Sitzungszustand cached
+DUMP_SECONDS = 10  # Intervall, in dem Worker ihre Profile auf Platte schreiben
+SQL_TOP = 5
+KEEP_SESSIONS = 20  # ältere Sitzungen samt Slow-Requests und .prof-Dateien werden entfernt
+
+class _Trace:
+    __slots__ = ("session_id", "slow_ms", "start", "queries", "profile",
+                 "method", "path", "endpoint", "status", "deferred", "done")
+
+    def __init__(self, session_id, slow_ms):
+        self.session_id = session_id
+        self.slow_ms = slow_ms
+        self.start = time.perf_counter()
+        self.queries = []
+        self.profile = None
+        self.method = request.method
+        self.path = request.path
+        self.endpoint = request.endpoint
+        self.status = None
+        self.deferred = False
+        self.done = False
+
+class RequestProfiler:
+    """
+    On-Demand-Profiling für api_bp/admin_bp.
+    Solange eine ProfilingSession aktiv ist, wird jeder Request gemessen
+    (inkl. SQL-Zeiten) und ein Anteil davon mit cProfile profiliert.
+    Jeder Worker sammelt seine Profile und schreibt sie nach PROFILE_DIR/<sitzung>/<pid>.prof;
+    merged_stats() führt die Dateien aller Worker zusammen.
+    """
+
+    def __init__(self, app=None):
+        self._app = None
+        self.profile_dir = None
+        self._dumper = PerProcessThread("profile-dump", self._dump_logged, DUMP_SECONDS, self._reset)
+        self._lock = threading.Lock()
+        # Ab Python 3.12 ist cProfile prozessweit – nur ein Profil gleichzeitig
+        self._profile_lock = threading.Lock()
+        self._stats = {}
+        self._state = None
+        self._state_checked = 0.0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self._app = app
+        self.profile_dir = Path(app.config["PROFILE_DIR"])
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.teardown_request(self._teardown_request)
+        with app.app_context():
+            event.listen(db.engine, "before_cursor_execute", _before_cursor_execute)
+            event.listen(db.engine, "after_cursor_execute", _after_cursor_execute)
+        app.extensions["request_profiler"] = self
+        atexit.register(self.dump)
+
+    # ---------- Zustand ----------
+
+    def _active_session(self):
+        now = time.monotonic()
+        if now - self._state_checked > STATE_TTL:
+            row = (
+                db.session.query(ProfilingSession.id, ProfilingSession.sample_rate,
+                                 ProfilingSession.slow_ms, ProfilingSession.until)
+                .filter(ProfilingSession.stopped.is_(False),
+                        ProfilingSession.until > dt.datetime.utcnow())
+                .order_by(ProfilingSession.id.desc())
+                .first()
+            )
+            self._state = tuple(row) if row else None
+            self._state_checked = now
+        state = self._state
+        if state and state[3] <= dt.datetime.utcnow():
+            return None
+        return state
+
+    def invalidate(self):
+        """Nach Start/Stopp im Admin: eigenen Worker sofort umschalten."""
+        self._state_checked = 0.0
+
+    # ---------- Request-Hooks ----------
+
+    def _before_request(self):
+        if request.blueprint not in PROFILED_BLUEPRINTS:
+            return
+        state = self._active_session()
+        if state is None:
+            return
+        self._dumper.ensure_started()
+        session_id, sample_rate, slow_ms, _ = state
+        trace = _Trace(session_id, slow_ms)
+        if random.random() < sample_rate and self._profile_lock.acquire(blocking=False):
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+                trace.profile = profile
+            except ValueError:
+                # anderes Profiling-Tool aktiv (z. B. Debugger)
+                self._profile_lock.release()
+        g.profiling_trace = trace
+
+    def _after_request(self, response):
+        trace = g.get("profiling_trace")
+        if trace is None:
+            return response
+        trace.status = response.status_code
+        trace.deferred = True
+        # Dauer erst beim Schließen der Antwort messen, damit das Streamen mitzählt
+        response.call_on_close(lambda: self._finish(trace))
+        return response
+
+    def _teardown_request(self, exc):
+        trace = g.pop("profiling_trace", None)
+        if trace is None:
+            return
+        # cProfile im selben Thread beenden, in dem es gestartet wurde
+        if trace.profile is not None:
+            trace.profile.disable()
+            self._profile_lock.release()
+            with self._lock:
+                agg = self._stats.get(trace.session_id)
+                if agg is None:
+                    self._stats[trace.session_id] = pstats.Stats(trace.profile)
+                else:
+                    agg.add(trace.profile)
+        if not trace.deferred:
+            # Fehler ohne after_request
+            trace.status = 500
+            self._finish(trace)
+
+    def _finish(self, trace):
+        if trace.done:
+            return
+        trace.done = True
+        duration_ms = (time.perf_counter() - trace.start) * 1000
+        if duration_ms >= trace.slow_ms:
+            self._record_slow(trace, duration_ms)
+
+    def _record_slow(self, trace, duration_ms):
+        sql_ms = sum(ms for _, ms in trace.queries)
+        top = sorted(trace.queries, key=lambda q: q[1], reverse=True)[:SQL_TOP]
+        try:
+            # Eigene Verbindung: der Request-Kontext ist hier ggf. schon beendet
+            with self._app.app_context():
+                with db.engine.begin() as conn:
+                    conn.execute(SlowRequest.__table__.insert().values(
+                        session_id=trace.session_id,
+                        method=trace.method,
+                        path=trace.path[:1024],
+                        endpoint=trace.endpoint,
+                        status=trace.status,
+                        duration_ms=round(duration_ms, 2),
+                        sql_count=len(trace.queries),
+                        sql_ms=round(sql_ms, 2),
+                        sql_top=json.dumps([{"sql": s, "ms": round(ms, 2)} for s, ms in top]),
+                        profiled=trace.profile is not None,
+                        created_at=dt.datetime.utcnow(),
+                    ))
+        except Exception:
+            self._app.logger.exception("Slow-Request konnte nicht gespeichert werden.")
+
+    # ---------- Ablage / Zusammenführen ----------
+
+    def dump(self):
+        with self._lock:
+            items = list(self._stats.items())
+        if not items or self.profile_dir is None:
+            return
+        pid = os.getpid()
+        for session_id, stats in items:
+            target = self.profile_dir / str(session_id)
+            target.mkdir(parents=True, exist_ok=True)
+            tmp = target / f".{pid}.prof.tmp"
+            with self._lock:
+                stats.dump_stats(tmp)
+            os.replace(tmp, target / f"{pid}.prof")
+        # Beendete Sitzungen nach dem letzten Schreiben freigeben
+        state = self._state
+        with self._lock:
+            for session_id, _ in items:
+                if not state or state[0] != session_id:
+                    self._stats.pop(session_id, None)
+
+    def merged_stats(self, session_id: int):
+        files = sorted((self.profile_dir / str(session_id)).glob("*.prof"))
+        if not files:
+            return None
+        return pstats.Stats(*[str(f) for f in files])
+
+    def export(self, session_id: int) -> bytes | None:
+        """Zusammengeführtes Profil im pstats-Format (snakeviz, pstats, gprof2dot)."""
+        stats = self.merged_stats(session_id)
+        return marshal.dumps(stats.stats) if stats else None
+
+    def summary(self, session_id: int, limit: int = 30) -> str | None:
+        stats = self.merged_stats(session_id)
+        if stats is None:
+            return None
+        out = io.StringIO()
+        stats.stream = out
+        stats.sort_stats("cumulative").print_stats(limit)
+        return out.getvalue()
+
+    def prune(self, keep: int = KEEP_SESSIONS):
+        """Behält nur die letzten `keep` Sitzungen (DB-Einträge und Profilverzeichnisse)."""
+        keep_ids = {sid for (sid,) in db.session.query(ProfilingSession.id)
+                    .order_by(ProfilingSession.id.desc()).limit(keep)}
+        old_ids = [sid for (sid,) in db.session.query(ProfilingSession.id)
+                   .filter(ProfilingSession.id.notin_(keep_ids))] if keep_ids else []
+        if old_ids:
+            SlowRequest.query.filter(SlowRequest.session_id.in_(old_ids)).delete(synchronize_session=False)
+            ProfilingSession.query.filter(ProfilingSession.id.in_(old_ids)).delete(synchronize_session=False)
+            db.session.commit()
+        # Auch verwaiste Verzeichnisse (z. B. nach manuellem Löschen) aufräumen
+        for path in self.profile_dir.iterdir():
+            if path.is_dir() and path.name.isdigit() and int(path.name) not in keep_ids:
+                shutil.rmtree(path, ignore_errors=True)
+
+    def _reset(self):
+        # Prozesslokaler Zustand – nach dem Fork neu anlegen
+        self._lock = threading.Lock()
+        self._profile_lock = threading.Lock()
+        self._stats = {}
+
+    def _dump_logged(self):
+        try:
+            self.dump()
+        except Exception:
+            self._app.logger.exception("Profil konnte nicht geschrieben werden.")
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    # Startzeit am Execution-Context statt an der (gepoolten) Verbindung –
+    # bei Fehlern bleibt so nichts liegen
+    if context is not None and has_request_context() and g.get("profiling_trace") is not None:
+        context.profiling_query_start = time.perf_counter()
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, "profiling_query_start", None)
+    if started is None or not has_request_context():
+        return
+    trace = g.get("profiling_trace")
+    if trace is not None:
+        trace.queries.append((" ".join(statement.split())[:500], (time.perf_counter() - started) * 1000))
+
+request_profiler = RequestProfiler()
@@ -1,5 +1,7 @@
 # fileserver/routes/admin.py
 import uuid
+import json
+import base64
 import mimetypes
 import secrets
 import shutil
@@ -9,21 +11,134 @@ from pathlib import Path
 from werkzeug.utils import secure_filename
 from flask import (
     render_template, request, redirect, url_for, abort, jsonify,
-    send_file, make_response
+    send_file, make_response, g
 )
 
 from . import admin_bp
 from ..config import Config
-from ..models import db, File, ApiToken
+from sqlalchemy import and_, or_, tuple_
+
+from ..models import db, File, FileChange, FileSummary, ApiToken, ProfilingSession, SlowRequest
 from ..utils import sha256_of_file, hash_token
 from ..renderers import detect_kind, RENDER_MATRIX
+from ..analytics import download_stats, top_files, top_tokens, time_series
+from ..profiling import request_profiler
 
 # ---------- Dashboard / Liste ----------
 
+# Sortierschlüssel fürs Keyset-Paging – direkt die Spalten, damit die (Schlüssel, id)-Indizes greifen
+SORT_KEYS = {
+    "created": File.created_at,
+    "title": File.title,
+    "year": File.year,
+    "mime": File.mime_type,
+}
+NULLABLE_SORT_KEYS = {"year"}
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+def _encode_cursor(value, file_id: str) -> str:
+    if isinstance(value, dt.datetime):
+        value = value.isoformat()
+    raw = json.dumps([value, file_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def _decode_cursor(cursor: str, sort: str):
+    try:
+        value, file_id = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        if sort == "created":
+            value = dt.datetime.fromisoformat(value)
+    except (ValueError, TypeError):
+        abort(400, "Ungültiger Cursor")
+    return value, file_id
+
+def _nulls_sort_high() -> bool:
+    # Postgres/Oracle sortieren NULL als größten Wert, SQLite/MySQL als kleinsten
+    return db.engine.dialect.name not in ("sqlite", "mysql", "mariadb", "mssql")
+
+def _keyset_segments(key, value, file_id, descending: bool, nullable: bool = False):
+    """
+    Filter für die Zeilen hinter dem Cursor, in Scan-Reihenfolge.
+    Der Zeilenwert-Vergleich (key, id) > (…) lässt die DB direkt im Index aufsetzen.
+    NULL-Werte bilden einen eigenen Block am Anfang oder Ende – dafür ein zweites
+    Segment statt eines OR, das den Index-Einstieg verhindern würde.
+    """
+    if descending:
+        beyond_id = File.id < file_id
+        beyond = None if value is None else tuple_(key, File.id) < tuple_(value, file_id)
+    else:
+        beyond_id = File.id > file_id
+        beyond = None if value is None else tuple_(key, File.id) > tuple_(value, file_id)
+    if not nullable:
+        return [beyond]
+    nulls_last = _nulls_sort_high() != descending
+    if value is None:
+        in_nulls = and_(key.is_(None), beyond_id)
+        return [in_nulls] if nulls_last else [in_nulls, key.isnot(None)]
+    return [beyond, key.is_(None)] if nulls_last else [beyond]
+
 @admin_bp.get("/")
 def index():
-    files = File.query.order_by(File.created_at.desc()).all()
-    return render_template("admin/index.html", files=files)
+    sort = request.args.get("sort", "created")
+    if sort not in SORT_KEYS:
+        sort = "created"
+    direction = request.args.get("dir", "desc" if sort == "created" else "asc")
+    descending = direction == "desc"
+    per_page = min(max(request.args.get("per_page", default=PAGE_SIZE, type=int), 1), MAX_PAGE_SIZE)
+    q = request.args.get("q", "").strip()
+    year = request.args.get("year", type=int)
+    mime = request.args.get("mime", "").strip()
+    after = request.args.get("after")
+    before = request.args.get("before")
+
+    key = SORT_KEYS[sort]
+    # Nur die angezeigten Spalten laden – keine ORM-Objekte
+    query = db.session.query(
+        File.id, File.title, File.year, File.mime_type, File.size_bytes, key.label("sort_key")
+    )
+    if q:
+        escaped = q.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        query = query.filter(File.title.ilike(f"%{escaped}%", escape="\\"))
+    if year is not None:
+        query = query.filter(File.year == year)
+    if mime:
+        query = query.filter(File.mime_type == mime)
+
+    # Rückwärts blättern: Reihenfolge umdrehen und Ergebnis wieder wenden
+    backwards = bool(before) and not after
+    scan_desc = descending != backwards
+    segments = [None]
+    if after or before:
+        value, file_id = _decode_cursor(after or before, sort)
+        segments = _keyset_segments(key, value, file_id, scan_desc, sort in NULLABLE_SORT_KEYS)
+    order = (key.desc(), File.id.desc()) if scan_desc else (key.asc(), File.id.asc())
+    rows = []
+    for cond in segments:
+        seg = query if cond is None else query.filter(cond)
+        rows += seg.order_by(*order).limit(per_page + 1 - len(rows)).all()
+        if len(rows) > per_page:
+            break
+
+    more = len(rows) > per_page
+    rows = rows[:per_page]
+    if backwards:
+        rows.reverse()
+    has_next = more if not backwards else True
+    has_prev = more if backwards else bool(after)
+
+    params = {k: v for k, v in {
+        "sort": sort, "dir": direction, "per_page": per_page if per_page != PAGE_SIZE else None,
+        "q": q or None, "year": year, "mime": mime or None,
+    }.items() if v is not None}
+    return render_template(
+        "admin/index.html",
+        files=rows,
+        summary=FileSummary.get(),
+        mime_types=[m for (m,) in db.session.query(File.mime_type).distinct().order_by(File.mime_type)],
+        params=params,
+        next_cursor=_encode_cursor(rows[-1].sort_key, rows[-1].id) if rows and has_next else None,
+        prev_cursor=_encode_cursor(rows[0].sort_key, rows[0].id) if rows and has_prev else None,
+    )
 
 # ---------- Rendering-Übersicht ----------
 
@@ -31,6 +146,90 @@ def index():
 def rendering_overview():
     return render_template("admin/rendering.html", matrix=RENDER_MATRIX)
 
+# ---------- Download-Statistik ----------
+
+@admin_bp.get("/stats")
+def stats_overview():
+    days = min(max(request.args.get("days", default=7, type=int), 1), 365)
+    file_id = request.args.get("file_id") or None
+    since = dt.datetime.utcnow() - dt.timedelta(days=days)
+    # Eigene, noch nicht geschriebene Zähler mitnehmen (andere Worker folgen im Flush-Intervall)
+    download_stats.flush()
+    return render_template(
+        "admin/stats.html",
+        days=days,
+        file_id=file_id,
+        files=top_files(since),
+        tokens=top_tokens(since),
+        series=time_series(since, file_id),
+        flush_seconds=download_stats.flush_seconds,
+    )
+
+# ---------- Profiling ----------
+
+@admin_bp.get("/profiling")
+def profiling_overview():
+    sessions = ProfilingSession.query.order_by(ProfilingSession.id.desc()).limit(20).all()
+    session_id = request.args.get("session_id", type=int)
+    current = ProfilingSession.query.get_or_404(session_id) if session_id else (sessions[0] if sessions else None)
+
+    slow, summary = [], None
+    if current:
+        # Eigenen Worker sofort schreiben, andere folgen im Dump-Intervall
+        request_profiler.dump()
+        slow = (SlowRequest.query.filter_by(session_id=current.id)
+                .order_by(SlowRequest.duration_ms.desc()).limit(50).all())
+        summary = request_profiler.summary(current.id)
+    return render_template(
+        "admin/profiling.html",
+        sessions=sessions,
+        current=current,
+        slow=slow,
+        summary=summary,
+    )
+
+@admin_bp.post("/profiling")
+def profiling_start():
+    percent = request.form.get("percent", default=5.0, type=float)
+    minutes = request.form.get("minutes", default=10, type=int)
+    slow_ms = request.form.get("slow_ms", default=500, type=int)
+    if not (0 <= percent <= 100) or not (1 <= minutes <= 60) or slow_ms < 0:
+        abort(400, "Anteil 0–100 %, Dauer 1–60 Minuten, Schwelle ≥ 0 ms")
+
+    # Immer nur eine aktive Sitzung
+    ProfilingSession.query.filter_by(stopped=False).update({"stopped": True})
+    rec = ProfilingSession(
+        started_by=g.admin.username,
+        sample_rate=percent / 100,
+        slow_ms=slow_ms,
+        until=dt.datetime.utcnow() + dt.timedelta(minutes=minutes),
+    )
+    db.session.add(rec)
+    db.session.commit()
+    request_profiler.invalidate()
+    request_profiler.prune()
+    return redirect(url_for("admin.profiling_overview", session_id=rec.id))
+
+@admin_bp.post("/profiling/<int:session_id>/stop")
+def profiling_stop(session_id):
+    rec = ProfilingSession.query.get_or_404(session_id)
+    rec.stopped = True
+    db.session.commit()
+    request_profiler.invalidate()
+    return redirect(url_for("admin.profiling_overview", session_id=session_id))
+
+@admin_bp.get("/profiling/<int:session_id>/download")
+def profiling_download(session_id):
+    _ = ProfilingSession.query.get_or_404(session_id)
+    request_profiler.dump()
+    data = request_profiler.export(session_id)
+    if data is None:
+        abort(404, "Noch keine Profildaten für diese Sitzung")
+    resp = make_response(data)
+    resp.headers["Content-Type"] = "application/octet-stream"
+    resp.headers["Content-Disposition"] = f'attachment; filename="profile-{session_id}.prof"'
+    return resp
+
 # ---------- Upload ----------
 
 @admin_bp.post("/upload")
@@ -70,6 +269,8 @@ def upload():
         checksum_sha256=checksum,
     )
     db.session.add(rec)
+    FileChange.record(fid, "create")
+    FileSummary.apply(1, size)
     db.session.commit()
     return redirect(url_for("admin.index"))
 
@@ -145,6 +346,9 @@ def file_update(file_id):
         abort(400, "Titel erforderlich")
     f.title = title
     f.year = year
+    # Ohne echte Änderung kein UPDATE (und kein neues updated_at) – dann auch kein Ereignis
+    if db.session.is_modified(f):
+        FileChange.record(file_id, "update")
     db.session.commit()
     return redirect(url_for("admin.file_detail", file_id=file_id))
 
@@ -157,6 +361,8 @@ def file_delete(file_id):
             shutil.rmtree(file_dir, ignore_errors=True)
     finally:
         db.session.delete(f)
+        FileChange.record(file_id, "delete")
+        FileSummary.apply(-1, -f.size_bytes)
         db.session.commit()
     return redirect(url_for("admin.index"))
 
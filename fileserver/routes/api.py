@@ -1,11 +1,12 @@
 # fileserver/routes/api.py
 import time, datetime as dt
 from pathlib import Path
-from flask import jsonify, url_for, abort, send_file, make_response, redirect, request
+from flask import jsonify, url_for, abort, send_file, make_response, redirect, request, g
 
 from . import api_bp
-from ..models import File
+from ..models import db, File, FileChange
 from ..utils import require_token, sign_download, verify_signature
+from ..analytics import download_stats, top_files, top_tokens, time_series
 
 @api_bp.get("/healthz")
 def healthz():
@@ -21,7 +22,8 @@ def api_list():
         "year": f.year,
         "mime_type": f.mime_type,
         "size_bytes": f.size_bytes,
-        "created_at": f.created_at.isoformat() + "Z"
+        "created_at": f.created_at.isoformat() + "Z",
+        "updated_at": f.updated_at.isoformat() + "Z"
     } for f in items])
 
 @api_bp.get("/files/<file_id>")
@@ -36,7 +38,71 @@ def api_file_meta(file_id):
         "size_bytes": f.size_bytes,
         "orig_filename": f.orig_filename,
         "checksum_sha256": f.checksum_sha256,
-        "created_at": f.created_at.isoformat() + "Z"
+        "created_at": f.created_at.isoformat() + "Z",
+        "updated_at": f.updated_at.isoformat() + "Z"
+    })
+
+CHANGES_DEFAULT_LIMIT = 100
+CHANGES_MAX_LIMIT = 500
+# IDs werden bei Postgres/MySQL vor dem Commit vergeben und können außer
+# Reihenfolge sichtbar werden – jüngste Ereignisse dort kurz zurückhalten.
+CHANGES_SETTLE_SECONDS = 5
+
+def _fetch_changes(since: int, limit: int):
+    # Nur Spalten laden; Metadaten per Outer-Join (bei gelöschten Dateien NULL)
+    query = (
+        db.session.query(
+            FileChange.id, FileChange.file_id, FileChange.op, FileChange.created_at,
+            File.title, File.year, File.mime_type, File.size_bytes,
+            File.created_at, File.updated_at,
+        )
+        .outerjoin(File, File.id == FileChange.file_id)
+        .filter(FileChange.id > since)
+    )
+    # SQLite serialisiert Schreibvorgänge, dort ist der Feed ohne Wartezeit lückenlos
+    if db.engine.dialect.name != "sqlite":
+        settled = dt.datetime.utcnow() - dt.timedelta(seconds=CHANGES_SETTLE_SECONDS)
+        query = query.filter(FileChange.created_at <= settled)
+    return query.order_by(FileChange.id.asc()).limit(limit + 1).all()
+
+@api_bp.get("/changes")
+@require_token(scopes_required=("read",))
+def api_changes():
+    """
+    Inkrementeller Änderungs-Feed: ?since=<cursor>&limit=<n>.
+    """
+    since = max(request.args.get("since", default=0, type=int), 0)
+    limit = min(max(request.args.get("limit", default=CHANGES_DEFAULT_LIMIT, type=int), 1), CHANGES_MAX_LIMIT)
+
+    rows = _fetch_changes(since, limit)
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    changes = []
+    for (cid, file_id, op, changed_at, title, year, mime_type, size_bytes, created_at, updated_at) in rows:
+        item = {
+            "cursor": cid,
+            "op": op,
+            "file_id": file_id,
+            "changed_at": changed_at.isoformat() + "Z",
+            "file": None,
+        }
+        if op != "delete" and title is not None:
+            # Aktueller Stand der Datei (kann neuer sein als das Ereignis)
+            item["file"] = {
+                "id": file_id,
+                "title": title,
+                "year": year,
+                "mime_type": mime_type,
+                "size_bytes": size_bytes,
+                "created_at": created_at.isoformat() + "Z",
+                "updated_at": updated_at.isoformat() + "Z",
+            }
+        changes.append(item)
+
+    return jsonify({
+        "changes": changes,
+        "next_cursor": changes[-1]["cursor"] if changes else since,
+        "has_more": has_more,
     })
 
 @api_bp.get("/files/<file_id>/signed-url")
@@ -44,25 +110,28 @@ def api_file_meta(file_id):
 def api_signed_url(file_id):
     _ = File.query.get_or_404(file_id)
     exp = int(time.time()) + 900  # 15 Minuten
-    sig = sign_download(file_id, exp)
+    tid = g.api_token_id
+    sig = sign_download(file_id, exp, tid)
     dl_url = url_for("api.api_file_download", file_id=file_id, _external=True)
-    return jsonify({"download_url": f"{dl_url}?exp={exp}&sig={sig}", "exp": exp})
+    return jsonify({"download_url": f"{dl_url}?exp={exp}&tid={tid}&sig={sig}", "exp": exp})
 
 @api_bp.get("/embed/<file_id>")
 @require_token(scopes_required=("read",))
 def api_embed(file_id):
     exp = int(time.time()) + 300
-    sig = sign_download(file_id, exp)
+    tid = g.api_token_id
+    sig = sign_download(file_id, exp, tid)
     dl_url = url_for("api.api_file_download", file_id=file_id, _external=True)
-    resp = redirect(f"{dl_url}?exp={exp}&sig={sig}", code=302)
+    resp = redirect(f"{dl_url}?exp={exp}&tid={tid}&sig={sig}", code=302)
     resp.headers["Cache-Control"] = "private, max-age=60"
     return resp
 
 @api_bp.get("/files/<file_id>/download")
 def api_file_download(file_id):
     exp = request.args.get("exp", type=int)
+    tid = request.args.get("tid", type=int)
     sig = request.args.get("sig", default="")
-    if not exp or not sig or not verify_signature(file_id, exp, sig):
+    if not exp or not sig or not verify_signature(file_id, exp, sig, tid):
         abort(403, "Ungültige oder abgelaufene Signatur")
 
     f = File.query.get_or_404(file_id)
@@ -80,4 +149,40 @@ def api_file_download(file_id):
     resp.headers["Accept-Ranges"] = "bytes"
     resp.headers["Cache-Control"] = "public, max-age=86400"
     resp.headers["Content-Disposition"] = f'inline; filename="{f.orig_filename}"'
+    # Geplante Bytes laut Content-Length (Abbrüche des Clients werden nicht erfasst)
+    download_stats.record(f.id, tid, resp.status_code, resp.content_length or 0)
     return resp
+
+# ---------- Download-Statistik ----------
+
+def _stats_since():
+    days = min(max(request.args.get("days", default=7, type=int), 1), 365)
+    return dt.datetime.utcnow() - dt.timedelta(days=days)
+
+def _iso_series(series):
+    for point in series:
+        point["bucket_start"] = point["bucket_start"].isoformat() + "Z"
+    return series
+
+@api_bp.get("/stats/top")
+@require_token(scopes_required=("stats",))
+def api_stats_top():
+    since = _stats_since()
+    limit = min(max(request.args.get("limit", default=20, type=int), 1), 100)
+    return jsonify({
+        "since": since.isoformat() + "Z",
+        "files": top_files(since, limit),
+        "tokens": top_tokens(since, limit),
+    })
+
+@api_bp.get("/stats/series")
+@require_token(scopes_required=("stats",))
+def api_stats_series():
+    since = _stats_since()
+    file_id = request.args.get("file_id") or None
+    return jsonify({
+        "since": since.isoformat() + "Z",
+        "file_id": file_id,
+        "bucket_seconds": download_stats.bucket_seconds,
+        "series": _iso_series(time_series(since, file_id)),
+    })
@@ -1,11 +1,44 @@
-import hmac, hashlib, time
+import hmac, hashlib, time, os, threading
 import datetime as dt
 from functools import wraps
-from flask import request, abort
+from flask import request, abort, g
 
 from .config import Config
 from .models import ApiToken, db
 
+class PerProcessThread:
+    """
+    Hintergrund-Thread, der in jedem Prozess genau einmal läuft.
+    Gunicorn forkt nach --preload und Threads überleben den Fork nicht –
+    daher erst beim ersten Aufruf im jeweiligen Worker starten.
+    on_start setzt vorher den prozesslokalen Zustand (Locks, Puffer) zurück.
+    """
+
+    def __init__(self, name: str, target, interval: float, on_start=None):
+        self.name = name
+        self.target = target
+        self.interval = interval
+        self.on_start = on_start
+        self._pid = None
+        self._start_lock = threading.Lock()
+
+    def ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            pid = os.getpid()
+            if self._pid == pid:
+                return
+            if self.on_start:
+                self.on_start()
+            threading.Thread(target=self._run, name=self.name, daemon=True).start()
+            self._pid = pid
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            self.target()
+
 def sha256_of_file(path, chunk_size=1024*1024):
     h = hashlib.sha256()
     with open(path, "rb") as f:
@@ -16,14 +49,15 @@ def sha256_of_file(path, chunk_size=1024*1024):
             h.update(chunk)
     return h.hexdigest()
 
-def sign_download(file_id: str, exp_ts: int) -> str:
-    msg = f"{file_id}:{exp_ts}".encode()
-    return hmac.new(Config.DOWNLOAD_HMAC_SECRET.encode(), msg, hashlib.sha256).hexdigest()
+def sign_download(file_id: str, exp_ts: int, token_id: int | None = None) -> str:
+    # token_id wird mitsigniert, damit Downloads dem Token zugeordnet werden können
+    msg = f"{file_id}:{exp_ts}" if token_id is None else f"{file_id}:{exp_ts}:{token_id}"
+    return hmac.new(Config.DOWNLOAD_HMAC_SECRET.encode(), msg.encode(), hashlib.sha256).hexdigest()
 
-def verify_signature(file_id: str, exp_ts: int, sig: str) -> bool:
+def verify_signature(file_id: str, exp_ts: int, sig: str, token_id: int | None = None) -> bool:
     if exp_ts < int(time.time()):
         return False
-    expected = sign_download(file_id, exp_ts)
+    expected = sign_download(file_id, exp_ts, token_id)
     return hmac.compare_digest(expected, sig)
 
 def hash_token(raw: str) -> str:
@@ -43,6 +77,8 @@ def require_token(scopes_required=("read",)):
             token_scopes = {s.strip() for s in (rec.scopes or "").split(",") if s.strip()}
             if not set(scopes_required).issubset(token_scopes):
                 abort(403, "Token hat nicht die benötigten Scopes")
+            # ID vor dem Commit merken – danach ist rec expired und bräuchte ein weiteres SELECT
+            g.api_token_id = rec.id
             rec.last_used_at = now
             db.session.commit()
             return fn(*args, **kwargs)
@@ -2,17 +2,21 @@
 import os
 import io
 import time
+import datetime
 import json
 import random
+import re
 import string
 import tempfile
 from urllib.parse import urljoin
 import requests
 
 BASE_URL = os.getenv("BASE_URL", "http://127.0.0.1:5000")
+ADMIN_USERNAME = os.getenv("ADMIN_USERNAME", "admin")
+ADMIN_PASSWORD = os.getenv("ADMIN_PASSWORD", "changeme")
 
 def wait_for_server(url: str, timeout=10.0):
-    print(f"[1/9] Warte auf Server {url} ...")
+    print(f"[1/14] Warte auf Server {url} ...")
     start = time.time()
     while time.time() - start < timeout:
         try:
@@ -26,8 +30,18 @@ def wait_for_server(url: str, timeout=10.0):
     print("      ⚠ Server nicht erreichbar. Prüfe, ob `python3 app.py` läuft.")
     return False
 
+def admin_login(session: requests.Session):
+    print("[2/14] Admin-Login ...")
+    url = urljoin(BASE_URL, "/admin/login")
+    r = session.post(url, data={"username": ADMIN_USERNAME, "password": ADMIN_PASSWORD},
+                     allow_redirects=False, timeout=10)
+    if r.status_code != 302:
+        raise RuntimeError(f"Login fehlgeschlagen: HTTP {r.status_code}")
+    print(f"      OK. Angemeldet als '{ADMIN_USERNAME}'.")
+    return True
+
 def create_token(session: requests.Session):
-    print("[2/9] Erzeuge API-Token ...")
+    print("[3/14] Erzeuge API-Token ...")
     url = urljoin(BASE_URL, "/admin/tokens")
     data = {"name": "test-client", "days": "1", "scopes": "read"}
     r = session.post(url, data=data, timeout=10)
@@ -41,14 +55,14 @@ def random_title():
     letters = string.ascii_lowercase + string.digits
     return "testfile-" + "".join(random.choice(letters) for _ in range(8))
 
-def upload_test_file(session: requests.Session, title: str):
-    print("[3/9] Lade Testdatei hoch ...")
+def upload_test_file(session: requests.Session, title: str, year: str = "2025"):
+    print("[4/14] Lade Testdatei hoch ...")
     url = urljoin(BASE_URL, "/admin/upload")
 
     # kleine Dummy-"mp3"-Datei (Inhalt ist egal; Endung zählt für MIME)
     fake_mp3 = io.BytesIO(b"ID3\x03\x00\x00\x00\x00\x00\x00TEST-DATA-" + os.urandom(256))
     files = {"file": ("test_upload.mp3", fake_mp3, "audio/mpeg")}
-    data = {"title": title, "year": "2025"}
+    data = {"title": title, "year": year}
 
     r = session.post(url, files=files, data=data, timeout=30, allow_redirects=True)
     if r.status_code not in (200, 302):
@@ -57,7 +71,7 @@ def upload_test_file(session: requests.Session, title: str):
     return True
 
 def find_uploaded_by_title(session: requests.Session, token: str, title: str):
-    print("[4/9] Suche hochgeladene Datei per API ...")
+    print("[5/14] Suche hochgeladene Datei per API ...")
     url = urljoin(BASE_URL, f"/api/files?token={token}")
     r = session.get(url, timeout=10)
     r.raise_for_status()
@@ -69,7 +83,7 @@ def find_uploaded_by_title(session: requests.Session, token: str, title: str):
     raise RuntimeError("Hochgeladene Datei in /api/files nicht gefunden.")
 
 def fetch_meta(session: requests.Session, token: str, file_id: str):
-    print("[5/9] Hole Metadaten ...")
+    print("[6/14] Hole Metadaten ...")
     url = urljoin(BASE_URL, f"/api/files/{file_id}?token={token}")
     r = session.get(url, timeout=10)
     r.raise_for_status()
@@ -78,18 +92,20 @@ def fetch_meta(session: requests.Session, token: str, file_id: str):
     return meta
 
 def fetch_signed_url(session: requests.Session, token: str, file_id: str):
-    print("[6/9] Hole kurzlebige signierte URL ...")
+    print("[7/14] Hole kurzlebige signierte URL ...")
     url = urljoin(BASE_URL, f"/api/files/{file_id}/signed-url?token={token}")
     r = session.get(url, timeout=10)
     r.raise_for_status()
     payload = r.json()
     signed = payload["download_url"]
     exp = payload["exp"]
+    if "tid=" not in signed:
+        raise RuntimeError("Signierte URL enthält keine Token-ID (tid).")
     print(f"      OK. signed_url (exp={exp}): {signed}")
     return signed
 
 def check_embed_redirect(session: requests.Session, token: str, file_id: str):
-    print("[7/9] Teste /api/embed Redirect ...")
+    print("[8/14] Teste /api/embed Redirect ...")
     url = urljoin(BASE_URL, f"/api/embed/{file_id}?token={token}")
     r = session.get(url, allow_redirects=False, timeout=10)
     if r.status_code != 302 or "Location" not in r.headers:
@@ -99,7 +115,7 @@ def check_embed_redirect(session: requests.Session, token: str, file_id: str):
     return location
 
 def range_request_first_100(session: requests.Session, download_url: str):
-    print("[8/9] Range-Request (erste 100 Bytes) ...")
+    print("[9/14] Range-Request (erste 100 Bytes) ...")
     r = session.get(download_url, headers={"Range": "bytes=0-99"}, timeout=20)
     if r.status_code not in (200, 206):
         raise RuntimeError(f"Range-Request fehlgeschlagen: HTTP {r.status_code}")
@@ -107,8 +123,201 @@ def range_request_first_100(session: requests.Session, download_url: str):
     print(f"      OK. Empfangene Bytes: {size} (Status {r.status_code})")
     return size
 
+def check_download_stats(session: requests.Session, file_id: str, timeout: float = 45.0):
+    print("[11/14] Download-Statistik (Voll, Range, If-None-Match) ...")
+    name = "stats-" + random_title()
+    r = session.post(urljoin(BASE_URL, "/admin/tokens"),
+                     data={"name": name, "days": "1", "scopes": "read,stats"}, timeout=10)
+    r.raise_for_status()
+    token = r.json()["token"]
+
+    download_url = fetch_signed_url(session, token, file_id)
+    full = session.get(download_url, timeout=20)
+    full.raise_for_status()
+    ranged = session.get(download_url, headers={"Range": "bytes=0-99"}, timeout=20)
+    if ranged.status_code != 206:
+        raise RuntimeError(f"Range-Download: HTTP {ranged.status_code} statt 206")
+    cached = session.get(download_url, headers={"If-None-Match": full.headers["ETag"]}, timeout=20)
+    if cached.status_code != 304:
+        raise RuntimeError(f"If-None-Match: HTTP {cached.status_code} statt 304")
+
+    # /admin/stats schreibt die Zähler des eigenen Workers; andere folgen im Flush-Intervall
+    deadline = time.time() + timeout
+    while True:
+        session.get(urljoin(BASE_URL, "/admin/stats"), timeout=10).raise_for_status()
+        r = session.get(urljoin(BASE_URL, "/api/stats/top"), params={"token": token, "days": 1}, timeout=10)
+        r.raise_for_status()
+        row = next((t for t in r.json()["tokens"] if t["name"] == name), None)
+        if row and row["requests"] >= 3:
+            break
+        if time.time() > deadline:
+            raise RuntimeError(f"Download-Statistik nicht geschrieben: {row}")
+        time.sleep(1)
+    expected = {"requests": 3, "full_requests": 1, "range_requests": 1, "not_modified": 1}
+    got = {k: row[k] for k in expected}
+    if got != expected or not row["token_id"]:
+        raise RuntimeError(f"Unerwartete Token-Statistik: {row}")
+
+    r = session.get(urljoin(BASE_URL, "/api/stats/series"),
+                    params={"token": token, "days": 1, "file_id": file_id}, timeout=10)
+    r.raise_for_status()
+    series = r.json()
+    now = time.time()
+    current = [p for p in series["series"]
+               if 0 <= now - _parse_utc(p["bucket_start"]) < series["bucket_seconds"]]
+    if not current or current[0]["requests"] < 3:
+        raise RuntimeError(f"Aktueller Bucket fehlt im Verlauf: {series['series']}")
+    print(f"      OK. Token {row['token_id']}: {got}, Bucket {current[0]['bucket_start']}.")
+    return True
+
+def _parse_utc(value: str) -> float:
+    return datetime.datetime.fromisoformat(value.rstrip("Z")).replace(tzinfo=datetime.timezone.utc).timestamp()
+
+def fetch_all_changes(session: requests.Session, token: str, since: int = 0, limit: int = 2):
+    """Blättert den Änderungs-Feed mit kleiner Seitengröße komplett durch."""
+    url = urljoin(BASE_URL, "/api/changes")
+    changes, pages = [], 0
+    while True:
+        r = session.get(url, params={"token": token, "since": since, "limit": limit}, timeout=10)
+        r.raise_for_status()
+        payload = r.json()
+        if len(payload["changes"]) > limit:
+            raise RuntimeError("Seite größer als limit.")
+        cursors = [c["cursor"] for c in payload["changes"]]
+        if cursors != sorted(cursors) or (cursors and cursors[0] <= since):
+            raise RuntimeError("Cursor nicht aufsteigend.")
+        changes.extend(payload["changes"])
+        pages += 1
+        if payload["changes"]:
+            if payload["next_cursor"] != cursors[-1]:
+                raise RuntimeError("next_cursor passt nicht zur letzten Änderung.")
+        elif payload["has_more"] or payload["next_cursor"] != since:
+            raise RuntimeError("Leere Seite mit has_more oder neuem Cursor.")
+        since = payload["next_cursor"]
+        if not payload["has_more"]:
+            return changes, since, pages
+
+def check_changes_full_catalog(session: requests.Session, token: str):
+    print("[12/14] Änderungs-Feed ab since=0 (Seitengröße 2) ...")
+    changes, cursor, pages = fetch_all_changes(session, token)
+    live = set()
+    for c in changes:
+        if c["op"] == "delete":
+            if c["file"] is not None:
+                raise RuntimeError("Delete-Ereignis mit Datei-Metadaten.")
+            live.discard(c["file_id"])
+        else:
+            live.add(c["file_id"])
+    r = session.get(urljoin(BASE_URL, f"/api/files?token={token}"), timeout=10)
+    r.raise_for_status()
+    listed = {item["id"] for item in r.json()}
+    if not listed <= live:
+        raise RuntimeError(f"Feed unvollständig, fehlt: {sorted(listed - live)}")
+    print(f"      OK. {len(changes)} Ereignisse auf {pages} Seiten, {len(live)} Dateien, Cursor={cursor}.")
+    return cursor
+
+def check_changes_update_delete(session: requests.Session, token: str, cursor: int):
+    print("[13/14] Update + Delete im Änderungs-Feed ...")
+    title = random_title()
+    upload_test_file(session, title)
+    file_id = find_uploaded_by_title(session, token, title)["id"]
+
+    base = urljoin(BASE_URL, f"/admin/files/{file_id}")
+    session.post(f"{base}/update", data={"title": title + "-neu", "year": "2024"}, timeout=10).raise_for_status()
+    # Unveränderter Stand darf kein weiteres Update-Ereignis erzeugen
+    session.post(f"{base}/update", data={"title": title + "-neu", "year": "2024"}, timeout=10).raise_for_status()
+    session.post(f"{base}/delete", timeout=10).raise_for_status()
+
+    changes, _, _ = fetch_all_changes(session, token, since=cursor, limit=1)
+    ops = [c["op"] for c in changes if c["file_id"] == file_id]
+    if ops != ["create", "update", "delete"]:
+        raise RuntimeError(f"Unerwartete Ereignisfolge: {ops}")
+    last = [c for c in changes if c["file_id"] == file_id][-1]
+    if last["file"] is not None:
+        raise RuntimeError("Delete-Ereignis muss file=null liefern.")
+    print(f"      OK. Ereignisse für {file_id}: {ops}")
+    return True
+
+def _dashboard_page(session: requests.Session, params: dict):
+    r = session.get(urljoin(BASE_URL, "/admin/"), params=params, timeout=10)
+    r.raise_for_status()
+    html = r.text
+    ids = re.findall(r"<code>([0-9a-f-]{36})</code>", html)
+    after = re.search(r"(?:\?|&amp;)after=([^\"&]+)", html)
+    before = re.search(r"(?:\?|&amp;)before=([^\"&]+)", html)
+    return ids, after and after.group(1), before and before.group(1)
+
+def _check_sorted(ids, meta, field, descending):
+    """Sortierschlüssel monoton, NULLs als Block an einem Ende, Gleichstände nach UUID."""
+    values = [meta[i][field] for i in ids]
+    nulls = [v is None for v in values]
+    n = sum(nulls)
+    if n and nulls != [True] * n + [False] * (len(ids) - n) and nulls != [False] * (len(ids) - n) + [True] * n:
+        raise RuntimeError(f"NULL-Werte nicht zusammenhängend ({field}).")
+    keyed = [((v is None), v if v is not None else 0, i) for v, i in zip(values, ids)]
+    for a, b in zip(keyed, keyed[1:]):
+        if a[0] != b[0]:
+            continue
+        pair = (a[1], a[2]) <= (b[1], b[2]) if not descending else (a[1], a[2]) >= (b[1], b[2])
+        if not pair:
+            raise RuntimeError(f"Falsche Reihenfolge bei {field}: {a} vor {b}")
+
+def check_dashboard_paging(session: requests.Session, token: str):
+    print("[14/14] Dashboard-Paging (Keyset, vor/zurück, NULL-Jahre, Gleichstände) ...")
+    prefix = random_title()
+    # Gleicher Titel zweimal, gleiche Jahre mehrfach, zwei Dateien ohne Jahr
+    specs = [("a", ""), ("a", "2001"), ("b", "2001"), ("c", ""), ("d", "2001")]
+    for suffix, year in specs:
+        upload_test_file(session, f"{prefix}-{suffix}", year)
+
+    r = session.get(urljoin(BASE_URL, f"/api/files?token={token}"), timeout=10)
+    r.raise_for_status()
+    meta = {item["id"]: item for item in r.json() if item["title"].startswith(prefix)}
+    if len(meta) != len(specs):
+        raise RuntimeError("Testdateien nicht vollständig gefunden.")
+    fields = {"created": "created_at", "title": "title", "year": "year", "mime": "mime_type"}
+
+    try:
+        for sort, field in fields.items():
+            for direction in ("asc", "desc"):
+                base = {"q": prefix, "sort": sort, "dir": direction}
+                full, after, before = _dashboard_page(session, {**base, "per_page": 200})
+                if sorted(full) != sorted(meta) or after or before:
+                    raise RuntimeError(f"Ungepagte Liste falsch ({sort}/{direction}).")
+                _check_sorted(full, meta, field, direction == "desc")
+
+                # Vorwärts: erste Seite ohne Zurück, letzte ohne Weiter
+                params = {**base, "per_page": 2}
+                ids, after, before = _dashboard_page(session, params)
+                first = ids
+                if before:
+                    raise RuntimeError("Erste Seite hat einen Zurück-Link.")
+                forward = [ids]
+                while after:
+                    ids, after, before = _dashboard_page(session, {**params, "after": after})
+                    if not before:
+                        raise RuntimeError("Folgeseite ohne Zurück-Link.")
+                    forward.append(ids)
+                if sum(forward, []) != full or [len(p) for p in forward] != [2, 2, 1]:
+                    raise RuntimeError(f"Vorwärts-Paging falsch ({sort}/{direction}): {forward}")
+
+                # Rückwärts von der letzten Seite bis Seite 1
+                backward = []
+                while before:
+                    ids, after, before = _dashboard_page(session, {**params, "before": before})
+                    if not after:
+                        raise RuntimeError("Seite ohne Weiter-Link beim Zurückblättern.")
+                    backward.append(ids)
+                if backward[-1] != first or sum(reversed(backward), []) + forward[-1] != full:
+                    raise RuntimeError(f"Rückwärts-Paging falsch ({sort}/{direction}): {backward}")
+        print(f"      OK. {len(fields) * 2} Sortierungen vor- und zurückgeblättert.")
+    finally:
+        for file_id in meta:
+            session.post(urljoin(BASE_URL, f"/admin/files/{file_id}/delete"), timeout=10)
+    return True
+
 def write_embed_html(file_id: str, token: str, path="embed_test.html"):
-    print("[9/9] Schreibe embed_test.html ...")
+    print("[10/14] Schreibe embed_test.html ...")
     html = f"""<!doctype html>
 <html lang="de">
   <meta charset="utf-8">
@@ -129,6 +338,7 @@ def main():
     s = requests.Session()
 
     try:
+        admin_login(s)
         token = create_token(s)
         title = random_title()
         upload_test_file(s, title)
@@ -139,6 +349,10 @@ def main():
         location = check_embed_redirect(s, token, file_id)
         range_request_first_100(s, location)
         write_embed_html(file_id, token)
+        check_download_stats(s, file_id)
+        cursor = check_changes_full_catalog(s, token)
+        check_changes_update_delete(s, token, cursor)
+        check_dashboard_paging(s, token)
 
         print("\n✅ Test erfolgreich abgeschlossen.")
         print(f"   • UUID: {file_id}")